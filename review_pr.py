@@ -1,11 +1,18 @@
 import os
 import github
 from github import Github
-import subprocess
-import tempfile
+import ast
+import asyncio
+import base64
+import functools
 import logging
 import re
-from crewai import Agent, Task, Crew
+import json
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pycodestyle
+from pyflakes.checker import Checker as PyflakesChecker
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 import sys
@@ -37,6 +44,90 @@ except ValueError:
     logger.error("PR_NUMBER must be a valid integer.")
     sys.exit(1)
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+MAX_WORKERS = 8
+GITHUB_WRITE_CONCURRENCY = 2
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_BATCH_SIZE = 50
+CHECKPOINT_FILE = ".pr_review_checkpoint.json"
+CONTENT_CACHE_FILE = ".pr_review_contents.json"
+PROMPT_BYTE_BUDGET = 60_000
+SNIPPET_LINE_CHARS = 300
+# GitHub rejects issue comments over 65,536 characters; keep some headroom
+COMMENT_CHAR_LIMIT = 65_000
+
+# Parses the "row:col: code text" part of a linter issue, after the known "path:" prefix
+_ISSUE_RE = re.compile(r'(\d+):(\d+): (\w+) (.*)$')
+_VAR_RE = re.compile(r"'([^']+)'")
+
+# Limits concurrent GitHub write calls (branches, commits, PRs) across fix PR threads;
+# GitHub asks clients to send content-creating requests serially
+github_write_semaphore = threading.Semaphore(GITHUB_WRITE_CONCURRENCY)
+
+# flake8 codes for pyflakes message classes, as reported by flake8
+PYFLAKES_CODES = {
+    'UnusedImport': 'F401',
+    'ImportShadowedByLoopVar': 'F402',
+    'ImportStarUsed': 'F403',
+    'LateFutureImport': 'F404',
+    'ImportStarUsage': 'F405',
+    'ImportStarNotPermitted': 'F406',
+    'FutureFeatureNotDefined': 'F407',
+    'PercentFormatInvalidFormat': 'F501',
+    'PercentFormatExpectedMapping': 'F502',
+    'PercentFormatExpectedSequence': 'F503',
+    'PercentFormatExtraNamedArguments': 'F504',
+    'PercentFormatMissingArgument': 'F505',
+    'PercentFormatMixedPositionalAndNamed': 'F506',
+    'PercentFormatPositionalCountMismatch': 'F507',
+    'PercentFormatStarRequiresSequence': 'F508',
+    'PercentFormatUnsupportedFormatCharacter': 'F509',
+    'StringDotFormatInvalidFormat': 'F521',
+    'StringDotFormatExtraNamedArguments': 'F522',
+    'StringDotFormatExtraPositionalArguments': 'F523',
+    'StringDotFormatMissingArgument': 'F524',
+    'StringDotFormatMixingAutomatic': 'F525',
+    'FStringMissingPlaceholders': 'F541',
+    'TStringMissingPlaceholders': 'F542',
+    'MultiValueRepeatedKeyLiteral': 'F601',
+    'MultiValueRepeatedKeyVariable': 'F602',
+    'TooManyExpressionsInStarredAssignment': 'F621',
+    'TwoStarredExpressions': 'F622',
+    'AssertTuple': 'F631',
+    'IsLiteral': 'F632',
+    'InvalidPrintSyntax': 'F633',
+    'IfTuple': 'F634',
+    'BreakOutsideLoop': 'F701',
+    'ContinueOutsideLoop': 'F702',
+    'YieldOutsideFunction': 'F704',
+    'ReturnOutsideFunction': 'F706',
+    'DefaultExceptNotLast': 'F707',
+    'DoctestSyntaxError': 'F721',
+    'ForwardAnnotationSyntaxError': 'F722',
+    'RedefinedWhileUnused': 'F811',
+    'UndefinedName': 'F821',
+    'UndefinedExport': 'F822',
+    'UndefinedLocal': 'F823',
+    'UnusedIndirectAssignment': 'F824',
+    'DuplicateArgument': 'F831',
+    'UnusedVariable': 'F841',
+    'UnusedAnnotation': 'F842',
+    'RaiseNotImplemented': 'F901',
+}
+
+# Mechanical issues reviewed with a fixed suggestion instead of an LLM call
+TRIVIAL_ISSUE_HINTS = {
+    'F401': "Remove the unused import.",
+    'F841': "Remove the unused variable or use it.",
+    'E225': "Add whitespace around the operator.",
+    'E231': "Add whitespace after ',', ';' or ':'.",
+    'E302': "Separate top-level definitions with two blank lines.",
+    'E303': "Remove the extra blank lines.",
+    'E305': "Add two blank lines after the function or class definition.",
+    'W291': "Remove the trailing whitespace.",
+    'W292': "End the file with a newline.",
+    'W293': "Remove the whitespace from the blank line.",
+    'W391': "Remove the blank line at the end of the file.",
+}
 
 # Log environment variables (partial for security)
 logger.info(f"Loaded token: {SEC_TOKEN[:4]}...")
@@ -62,129 +153,363 @@ if os.getenv("GITHUB_ACTIONS") != "true":
     except ImportError:
         logger.warning("inquirer not available, using environment variables")
 
-# Initialize GitHub client
-try:
-    github_client = Github(SEC_TOKEN)
-    repo = github_client.get_repo(REPO_NAME)
-except github.GithubException as e:
-    logger.error(f"Failed to initialize GitHub client: {str(e)}")
-    sys.exit(1)
-
-# Initialize LLM (Gemini AI)
-try:
-    llm = ChatGoogleGenerativeAI(
-        model=GEMINI_MODEL,
-        google_api_key=GOOGLE_API_KEY,
-        temperature=0.7,
-    )
-except Exception as e:
-    logger.error(f"Failed to initialize Gemini AI LLM: {str(e)}")
-    sys.exit(1)
-
-# Define CrewAI Agents
-code_reviewer = Agent(
-    role="Code Reviewer",
-    goal="Analyze Python code in a GitHub PR, identify issues using flake8, and generate clear review comments.",
-    backstory="You are an experienced Python developer with expertise in code quality and best practices.",
-    tools=[],
-    llm=llm,
-    verbose=True
-)
-
-code_fixer = Agent(
-    role="Code Fixer",
-    goal="Suggest and apply fixes for identified Python issues, creating a new PR with the changes.",
-    backstory="You are a skilled developer who automates fixes for common Python issues.",
-    tools=[],
-    llm=llm,
-    verbose=True
-)
-
-def create_flake8_config():
-    """Create a basic flake8 configuration for the project."""
-    flake8_config = """
-    [flake8]
-    max-line-length = 88
-    select = E,F,W,B,B950
-    ignore = E501
-    """
+@functools.lru_cache(maxsize=1)
+def get_repo():
+    """Initialize the GitHub client and repository on first use."""
     try:
-        with open('.flake8', 'w') as f:
-            f.write(flake8_config)
-        logger.info("Created flake8 configuration")
-    except Exception as e:
-        logger.error(f"Failed to create flake8 config: {str(e)}")
+        github_client = Github(SEC_TOKEN, per_page=100)
+        return github_client.get_repo(REPO_NAME)
+    except github.GithubException as e:
+        logger.error(f"Failed to initialize GitHub client: {str(e)}")
+        sys.exit(1)
 
-def run_linter(file_content, file_path):
-    """Run flake8 on the provided file content and return issues."""
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    """Initialize the Gemini AI LLM on first use."""
     try:
-        # Ensure flake8 config exists
-        if not os.path.exists('.flake8'):
-            create_flake8_config()
+        return ChatGoogleGenerativeAI(
+            model=GEMINI_MODEL,
+            google_api_key=GOOGLE_API_KEY,
+            temperature=0.7,
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialize Gemini AI LLM: {str(e)}")
+        sys.exit(1)
 
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
+class CollectingReport(pycodestyle.BaseReport):
+    """pycodestyle report that collects errors instead of printing them."""
 
-        result = subprocess.run(["flake8", temp_file_path, "--format=%(path)s:%(row)d:%(col)d: %(code)s %(text)s"], capture_output=True, text=True)
-        os.unlink(temp_file_path)
+    def __init__(self, options):
+        super().__init__(options)
+        self.errors = []
 
-        if result.returncode != 0 and not result.stdout:
-            logger.warning(f"flake8 returned no output for {file_path}: {result.stderr}")
-            return []
+    def error(self, line_number, offset, text, check):
+        code = super().error(line_number, offset, text, check)
+        if code:
+            self.errors.append((line_number, offset + 1, text))
+        return code
 
-        if not result.stdout.strip():
-            return []
+@functools.lru_cache(maxsize=1)
+def get_style_options():
+    """Build the pycodestyle options once per process."""
+    # Same options the project's flake8 config used: max-line-length 88, E501 ignored
+    return pycodestyle.StyleGuide(max_line_length=88, ignore=['E501']).options
 
-        issues = result.stdout.splitlines()
-        return issues
+def run_linter(file_content, file_path):
+    """Lint file content in-process with pyflakes and pycodestyle and return flake8-style issues."""
+    try:
+        try:
+            tree = ast.parse(file_content, filename=file_path)
+        except SyntaxError as e:
+            # Like flake8, report only the syntax error; the other checks are noise on unparsable code
+            return [f"{file_path}:{e.lineno or 1}:{(e.offset or 0) + 1}: E999 {type(e).__name__}: {e.msg}"]
+
+        errors = []
+        for message in PyflakesChecker(tree, filename=file_path).messages:
+            code = PYFLAKES_CODES.get(type(message).__name__, 'F999')
+            errors.append((message.lineno, getattr(message, 'col', 0) + 1, f"{code} {message.message % message.message_args}"))
+
+        options = get_style_options()
+        report = CollectingReport(options)
+        pycodestyle.Checker(file_path, lines=file_content.splitlines(True), options=options, report=report).check_all()
+        errors.extend(report.errors)
+
+        errors.sort(key=lambda error: (error[0], error[1]))
+        return [f"{file_path}:{row}:{col}: {text}" for row, col, text in errors]
     except Exception as e:
-        logger.error(f"Error running flake8 on {file_path}: {str(e)}")
+        logger.error(f"Error linting {file_path}: {str(e)}")
         return []
 
+def lint_all_files(files):
+    """Lint all file contents and return issues grouped by file path."""
+    return {path: run_linter(content, path) for path, content in files.items()}
+
+def graphql_query(query, variables):
+    """Run a GitHub GraphQL query and return its data, or None on failure."""
+    try:
+        response = requests.post(
+            GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            headers={"Authorization": f"Bearer {SEC_TOKEN}"},
+            timeout=30
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            logger.error(f"GraphQL query failed: {payload['errors']}")
+            return None
+        return payload["data"]
+    except requests.RequestException as e:
+        logger.error(f"GraphQL request failed: {str(e)}")
+        return None
+
 def get_pr_files(pr_number):
-    """Fetch Python files from a GitHub PR."""
+    """Fetch the head SHA and changed Python file paths of a GitHub PR, 100 files per GraphQL call."""
+    owner, name = REPO_NAME.split('/', 1)
+    query = """
+    query($owner: String!, $name: String!, $number: Int!, $after: String) {
+      repository(owner: $owner, name: $name) {
+        pullRequest(number: $number) {
+          headRefOid
+          files(first: 100, after: $after) {
+            nodes { path changeType }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+      }
+    }
+    """
+    head_sha = None
+    py_files = []
+    after = None
+    while True:
+        data = graphql_query(query, {"owner": owner, "name": name, "number": pr_number, "after": after})
+        if not data or not data["repository"]["pullRequest"]:
+            logger.error(f"Error fetching PR #{pr_number}")
+            return None, []
+
+        pull_request = data["repository"]["pullRequest"]
+        head_sha = pull_request["headRefOid"]
+        files = pull_request["files"]
+        py_files.extend(
+            node["path"] for node in files["nodes"]
+            if node["path"].endswith('.py') and node["changeType"] != "DELETED"
+        )
+        if not files["pageInfo"]["hasNextPage"]:
+            break
+        after = files["pageInfo"]["endCursor"]
+
+    if not py_files:
+        logger.info("No Python files found in PR.")
+    return head_sha, py_files
+
+def load_content_cache(head_sha):
+    """Load file texts cached for this commit by a previous run."""
     try:
-        pr = repo.get_pull(pr_number)
-        files = pr.get_files()
-        py_files = [f for f in files if f.filename.endswith('.py')]
-        if not py_files:
-            logger.info("No Python files found in PR.")
-            return []
-        return py_files
-    except github.GithubException as e:
-        logger.error(f"Error fetching PR #{pr_number}: {str(e)}")
-        return []
+        with open(CONTENT_CACHE_FILE, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get("head_sha") == head_sha:
+            return cache.get("files", {})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable content cache: {str(e)}")
+    return {}
+
+def save_content_cache(head_sha, files):
+    """Persist file texts for this commit so reruns do not fetch them again."""
+    try:
+        with open(CONTENT_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"head_sha": head_sha, "files": files}, f, ensure_ascii=False)
+    except OSError as e:
+        logger.warning(f"Failed to write content cache: {str(e)}")
 
-def review_task_func(file_content, file_path):
-    """Generate review comments for a file using flake8 and LLM."""
+def get_blob_text(oid, file_path):
+    """Fetch the full text of a blob over REST, for files GraphQL only returns truncated."""
     try:
-        issues = run_linter(file_content, file_path)
-        if not issues:
-            return f"✅ No issues found in {file_path}"
-
-        prompt = (
-            "You are a code review assistant for a Python project. Below is a list of issues found by flake8:\n\n"
-            f"{chr(10).join(issues)}\n\n"
-            f"Code:\n``````\n{file_content}\n``````\n\n"
-            "For each issue, provide a clear, concise, and actionable comment explaining the problem and suggesting a fix. "
-            "Format your response as a bulleted list with specific line references."
+        blob = get_repo().get_git_blob(oid)
+        return base64.b64decode(blob.content).decode()
+    except (github.GithubException, ValueError) as e:
+        logger.error(f"Error fetching content for {file_path}: {str(e)}")
+        return None
+
+def get_file_contents(head_sha, file_paths):
+    """Fetch the text of several files at a commit, using the local cache before aliased GraphQL calls."""
+    # File contents at a commit never change, so cached texts for this SHA are always valid
+    cached = load_content_cache(head_sha)
+    contents = {path: cached[path] for path in file_paths if path in cached}
+    file_paths = [path for path in file_paths if path not in cached]
+    if not file_paths:
+        return contents
+
+    owner, name = REPO_NAME.split('/', 1)
+    fetched = {}
+    for batch_start in range(0, len(file_paths), GRAPHQL_BATCH_SIZE):
+        batch = file_paths[batch_start:batch_start + GRAPHQL_BATCH_SIZE]
+        params = "".join(f", $e{i}: String!" for i in range(len(batch)))
+        fields = "\n".join(
+            f"f{i}: object(expression: $e{i}) {{ ... on Blob {{ oid text isTruncated isBinary }} }}"
+            for i in range(len(batch))
         )
-        response = llm.invoke(prompt)
-        return response.content
+        query = f"query($owner: String!, $name: String!{params}) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}"
+        variables = {"owner": owner, "name": name}
+        variables.update({f"e{i}": f"{head_sha}:{path}" for i, path in enumerate(batch)})
+
+        data = graphql_query(query, variables)
+        if not data:
+            continue
+
+        for i, path in enumerate(batch):
+            blob = data["repository"].get(f"f{i}")
+            if not blob:
+                logger.error(f"Error fetching content for {path}")
+                continue
+            if blob.get("isBinary"):
+                logger.info(f"Skipping binary file {path}")
+                continue
+            if blob.get("isTruncated") or blob.get("text") is None:
+                # Never lint, fix or cache a partial file
+                text = get_blob_text(blob["oid"], path)
+                if text is None:
+                    continue
+            else:
+                text = blob["text"]
+            fetched[path] = text
+
+    contents.update(fetched)
+    cached.update(fetched)
+    save_content_cache(head_sha, cached)
+    return contents
+
+def split_trivial_issues(issues, file_path):
+    """Turn trivial issues into templated review bullets and return them with the remaining issues."""
+    bullets = []
+    remaining = []
+    prefix_len = len(file_path) + 1
+    for issue in issues:
+        match = _ISSUE_RE.match(issue, prefix_len)
+        if match and match.group(3) in TRIVIAL_ISSUE_HINTS:
+            row, _, code, message = match.groups()
+            bullets.append(f"- Line {row}: `{code}` {message}. {TRIVIAL_ISSUE_HINTS[code]}")
+        else:
+            remaining.append(issue)
+    return bullets, remaining
+
+def build_issue_blocks(issues, lines, file_path, max_bytes, context=3):
+    """Group linter issues into blocks that share one numbered snippet per cluster of nearby lines.
+
+    Each block stays within max_bytes, so dense files are spread over several blocks.
+    """
+    blocks = []
+    located = []
+    for issue in issues:
+        match = _ISSUE_RE.match(issue, len(file_path) + 1)
+        if match:
+            located.append((int(match.group(1)), issue))
+        else:
+            blocks.append(f"Issues:\n- {issue}")
+
+    # Very long lines (e.g. minified code) are shortened so a single issue always fits
+    numbered = [
+        f"{num}: {line if len(line) <= SNIPPET_LINE_CHARS else line[:SNIPPET_LINE_CHARS] + ' …'}\n"
+        for num, line in enumerate(lines, 1)
+    ]
+    offsets = [0]
+    for line in numbered:
+        offsets.append(offsets[-1] + len(line.encode()))
+    # "Issues:\n" + "Context:\n``````\n" + "``````"
+    block_overhead = 30
+
+    # Merge overlapping or touching windows so each source line is sent at most once,
+    # closing a cluster once it would outgrow max_bytes
+    clusters = []
+    for row, issue in sorted(located, key=lambda item: item[0]):
+        start = max(0, row - 1 - context)
+        end = min(len(lines), row + context)
+        issue_size = len(f"- {issue}\n".encode())
+        if clusters and start <= clusters[-1][1]:
+            cluster_start, cluster_end, cluster_issues, issues_size = clusters[-1]
+            merged_end = max(cluster_end, end)
+            merged_size = block_overhead + issues_size + issue_size + offsets[merged_end] - offsets[cluster_start]
+            if merged_size <= max_bytes:
+                clusters[-1] = [cluster_start, merged_end, cluster_issues + [issue], issues_size + issue_size]
+                continue
+        clusters.append([start, end, [issue], issue_size])
+
+    for start, end, cluster_issues, _ in clusters:
+        listed = "".join(f"- {issue}\n" for issue in cluster_issues)
+        snippet = "".join(numbered[start:end])
+        blocks.append(f"Issues:\n{listed}Context:\n``````\n{snippet}``````")
+    return blocks
+
+def build_review_prompts(file_content, issues, file_path):
+    """Build LLM review prompts for a file, packing issue blocks into batches of at most PROMPT_BYTE_BUDGET bytes."""
+    header = (
+        "You are a code review assistant for a Python project. Below are issues found by flake8, "
+        "grouped with the surrounding lines of code:\n\n"
+    )
+    footer = (
+        "\n\nFor each issue, provide a clear, concise, and actionable comment explaining the problem and suggesting a fix. "
+        "Format your response as a bulleted list with specific line references."
+    )
+    overhead = len(header.encode()) + len(footer.encode())
+
+    # Only send the lines around each issue rather than the whole file
+    lines = file_content.splitlines()
+    prompts = []
+    batch = []
+    batch_size = overhead
+    for block in build_issue_blocks(issues, lines, file_path, PROMPT_BYTE_BUDGET - overhead - 2):
+        block_size = len(block.encode()) + 2
+        if batch and batch_size + block_size > PROMPT_BYTE_BUDGET:
+            prompts.append(header + "\n\n".join(batch) + footer)
+            batch = []
+            batch_size = overhead
+        batch.append(block)
+        batch_size += block_size
+    if batch:
+        prompts.append(header + "\n\n".join(batch) + footer)
+    return prompts
+
+def review_task_func(file_contents, file_issues):
+    """Generate review comments for all files, sending every LLM prompt in one concurrent batch."""
+    reviews = {}
+    templated = {}
+    prompts = []
+    prompt_files = []
+    for file_path, file_content in file_contents.items():
+        bullets, remaining = split_trivial_issues(file_issues[file_path], file_path)
+        templated[file_path] = "\n".join(bullets)
+        file_prompts = build_review_prompts(file_content, remaining, file_path)
+        if file_prompts:
+            prompts.extend(file_prompts)
+            prompt_files.extend([file_path] * len(file_prompts))
+        elif bullets:
+            reviews[file_path] = templated[file_path]
+        else:
+            reviews[file_path] = f"✅ No issues found in {file_path}"
+
+    if not prompts:
+        return reviews
+
+    try:
+        responses = asyncio.run(get_llm().abatch(
+            prompts,
+            config={"max_concurrency": MAX_WORKERS},
+            return_exceptions=True
+        ))
     except Exception as e:
-        logger.error(f"Error generating review comments for {file_path}: {str(e)}")
-        return f"❌ Failed to generate comments for {file_path}: {str(e)}"
+        responses = [e] * len(prompts)
+
+    # Merge the responses for each file's prompt batches in order
+    parts = {}
+    failures = {}
+    for file_path, response in zip(prompt_files, responses):
+        if isinstance(response, Exception):
+            failures.setdefault(file_path, response)
+        else:
+            parts.setdefault(file_path, [templated[file_path]]).append(response.content)
+
+    for file_path in dict.fromkeys(prompt_files):
+        if file_path in failures:
+            logger.error(f"Error generating review comments for {file_path}: {str(failures[file_path])}")
+            failure = f"❌ Failed to generate comments for {file_path}: {str(failures[file_path])}"
+            reviews[file_path] = "\n".join(part for part in (templated[file_path], failure) if part)
+        else:
+            reviews[file_path] = "\n".join(part for part in parts[file_path] if part)
+    return reviews
 
 def fix_task_func(file_content, issues, file_path):
     """Suggest and apply fixes for identified Python issues."""
     try:
         lines = file_content.splitlines()
-        fixed_lines = lines.copy()
+        replacements = {}
+        prepends = []
         comments = []
+        prefix_len = len(file_path) + 1
 
         for issue in issues:
-            match = re.match(r'.*?:(\d+):(\d+): (\w+) (.*)', issue)
+            match = _ISSUE_RE.match(issue, prefix_len)
             if match:
                 line_num = int(match.group(1)) - 1
                 code = match.group(3)
@@ -192,22 +517,27 @@ def fix_task_func(file_content, issues, file_path):
 
                 if line_num < len(lines):
                     if code == 'F841' and 'undefined name' not in message:  # Unused variable
-                        var_match = re.search(r"'([^']+)'", message)
+                        var_match = _VAR_RE.search(message)
                         if var_match:
                             var_name = var_match.group(1)
-                            fixed_lines[line_num] = f"# Removed unused variable: {lines[line_num]}"
+                            replacements[line_num] = f"# Removed unused variable: {lines[line_num]}"
                             comments.append(f"Line {line_num + 1}: Removed unused variable '{var_name}'")
-                    elif code == 'D100' and 'missing docstring' in message:  # Missing docstring
-                        fixed_lines.insert(0, '"""Sample docstring."""')
+                    elif code == 'D100' and 'missing docstring' in message and not prepends:  # Missing docstring
+                        prepends.append('"""Sample docstring."""')
                         comments.append("Line 1: Added missing docstring")
 
-        return {'fixed_content': '\n'.join(fixed_lines), 'comments': comments}
+        # Rebuild the file in a single pass over the original lines
+        output = prepends
+        for i, line in enumerate(lines):
+            output.append(replacements.get(i, line))
+
+        return {'fixed_content': '\n'.join(output), 'comments': comments}
     except Exception as e:
         logger.error(f"Error suggesting fixes for {file_path}: {str(e)}")
         return {'fixed_content': file_content, 'comments': []}
 
-def create_fix_pr(pr_number, file_path, fixed_content, comments):
-    """Create a PR with suggested fixes."""
+def confirm_fix_pr(file_path):
+    """Ask whether to create a fix PR for a file on local runs; always True in CI."""
     if os.getenv("GITHUB_ACTIONS") != "true":
         try:
             import inquirer
@@ -215,44 +545,58 @@ def create_fix_pr(pr_number, file_path, fixed_content, comments):
             answers = inquirer.prompt(questions)
             if not answers or not answers["create_pr"]:
                 logger.info(f"Skipped creating fix PR for {file_path}")
-                return None
+                return False
         except ImportError:
             logger.warning("inquirer not available, auto-creating PR")
+    return True
+
+def create_git_ref(repo, ref, sha):
+    """Create a git ref while holding the GitHub write semaphore."""
+    with github_write_semaphore:
+        return repo.create_git_ref(ref=ref, sha=sha)
 
+def create_fix_pr(pr, file_path, fixed_content, comments):
+    """Create a PR with suggested fixes."""
+    pr_number = pr.number
     try:
-        pr = repo.get_pull(pr_number)
+        repo = get_repo()
         branch_name = f"fix-pr-{pr_number}-{file_path.replace('/', '-').replace('.', '-')}"
 
-        # Create new branch from PR's head
-        repo.create_git_ref(
-            ref=f"refs/heads/{branch_name}",
-            sha=pr.head.sha
-        )
+        # Create new branch from PR's head while fetching the current file SHA
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ref_future = executor.submit(
+                create_git_ref,
+                repo,
+                ref=f"refs/heads/{branch_name}",
+                sha=pr.head.sha
+            )
+            file_future = executor.submit(repo.get_contents, file_path, ref=pr.head.ref)
+        ref_future.result()
 
-        # Get current file content and SHA
         try:
-            current_file = repo.get_contents(file_path, ref=pr.head.ref)
-            file_sha = current_file.sha
+            file_sha = file_future.result().sha
         except github.GithubException:
             logger.error(f"Could not fetch current file {file_path}")
             return None
 
         # Update file with fixes
-        repo.update_file(
-            path=file_path,
-            message=f"Automated fixes for PR #{pr_number}: {file_path}",
-            content=fixed_content,
-            sha=file_sha,
-            branch=branch_name
-        )
+        with github_write_semaphore:
+            repo.update_file(
+                path=file_path,
+                message=f"Automated fixes for PR #{pr_number}: {file_path}",
+                content=fixed_content,
+                sha=file_sha,
+                branch=branch_name
+            )
 
         # Create pull request
-        fix_pr = repo.create_pull(
-            title=f"🔧 Automated Fixes for PR #{pr_number}: {file_path}",
-            body=f"Automated fixes for `{file_path}`:\n\n" + "\n".join([f"- {comment}" for comment in comments]) + f"\n\n🔗 Related to PR #{pr_number}",
-            head=branch_name,
-            base=pr.base.ref
-        )
+        with github_write_semaphore:
+            fix_pr = repo.create_pull(
+                title=f"🔧 Automated Fixes for PR #{pr_number}: {file_path}",
+                body=f"Automated fixes for `{file_path}`:\n\n" + "\n".join([f"- {comment}" for comment in comments]) + f"\n\n🔗 Related to PR #{pr_number}",
+                head=branch_name,
+                base=pr.base.ref
+            )
 
         logger.info(f"Created fix PR #{fix_pr.number}")
         return fix_pr.number
@@ -260,61 +604,157 @@ def create_fix_pr(pr_number, file_path, fixed_content, comments):
         logger.error(f"Error creating fix PR for {file_path}: {str(e)}")
         return None
 
+def load_checkpoint(pr_number, head_sha):
+    """Load the filenames already reviewed and the fix PRs already created for this PR head."""
+    try:
+        with open(CHECKPOINT_FILE, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("pr_number") == pr_number and checkpoint.get("head_sha") == head_sha:
+            return set(checkpoint.get("completed", [])), checkpoint.get("fix_prs", {})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint file: {str(e)}")
+    return set(), {}
+
+def save_checkpoint(pr_number, head_sha, completed, fix_prs):
+    """Persist the reviewed filenames and created fix PRs so reruns can skip them."""
+    try:
+        with open(CHECKPOINT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                "pr_number": pr_number,
+                "head_sha": head_sha,
+                "completed": sorted(completed),
+                "fix_prs": fix_prs
+            }, f)
+    except OSError as e:
+        logger.warning(f"Failed to write checkpoint file: {str(e)}")
+
+def truncate_review(review_comments, limit):
+    """Cut review text on a line boundary to at most limit characters, closing any open code fence."""
+    if len(review_comments) <= limit:
+        return review_comments
+
+    note = "\n\n_… review truncated to fit GitHub's comment size limit._"
+    closing_fence = "\n```"
+    budget = limit - len(note) - len(closing_fence)
+    kept = []
+    size = 0
+    in_fence = False
+    for line in review_comments.splitlines(True):
+        if size + len(line) > budget:
+            if not kept:
+                # A single overlong first line is cut rather than dropped
+                kept.append(line[:budget])
+            break
+        kept.append(line)
+        size += len(line)
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+
+    text = "".join(kept).rstrip("\n")
+    if in_fence:
+        text += closing_fence
+    return text + note
+
+def build_review_section(file_path, review_comments, fix_pr_number=None):
+    """Build the review comment section for a single PR file, always fitting in one comment."""
+    header = f"## 🔍 Review for `{file_path}`\n\n"
+    footer = ""
+    if fix_pr_number:
+        footer = f"\n\n### 🔧 Automated Fixes\n\nCreated fix PR #{fix_pr_number} with automated fixes for `{file_path}`."
+    review_comments = truncate_review(review_comments, COMMENT_CHAR_LIMIT - len(header) - len(footer))
+    return header + review_comments + footer
+
+def pack_comments(sections):
+    """Pack (file_path, section) pairs into as few comment bodies under COMMENT_CHAR_LIMIT as possible.
+
+    Returns (body, file_paths) pairs; each file's section is whole within one body.
+    """
+    separator = "\n\n---\n\n"
+    comments = []
+    body = ""
+    finished = []
+    for file_path, section in sections:
+        if body and len(body) + len(separator) + len(section) > COMMENT_CHAR_LIMIT:
+            comments.append((body, finished))
+            body = ""
+            finished = []
+        body = f"{body}{separator}{section}" if body else section
+        finished.append(file_path)
+    if body:
+        comments.append((body, finished))
+    return comments
+
 def main():
     """Main function to orchestrate the code review process."""
     try:
-        pr_files = get_pr_files(PR_NUMBER)
+        head_sha, pr_files = get_pr_files(PR_NUMBER)
         if not pr_files:
             logger.info("No files to process. Exiting.")
             return
 
-        # Create CrewAI crew
-        crew = Crew(
-            agents=[code_reviewer, code_fixer],
-            tasks=[],
-            verbose=True
-        )
-
-        for file in pr_files:
-            logger.info(f"Processing {file.filename}")
+        pr = get_repo().get_pull(PR_NUMBER)
+        completed, fix_prs = load_checkpoint(PR_NUMBER, head_sha)
+        pending = [path for path in pr_files if path not in completed]
+        if len(pending) < len(pr_files):
+            logger.info(f"Skipping {len(pr_files) - len(pending)} file(s) already processed")
 
-            try:
-                file_content = repo.get_contents(file.filename, ref=repo.get_pull(PR_NUMBER).head.sha).decoded_content.decode()
-            except github.GithubException as e:
-                logger.error(f"Error fetching content for {file.filename}: {str(e)}")
-                continue
+        file_contents = get_file_contents(head_sha, pending)
 
-            # Execute review task
-            review_comments = review_task_func(file_content, file.filename)
+        # Lint every file in-process before any review work starts
+        file_issues = lint_all_files(file_contents)
 
-            # Post review comments
-            try:
-                repo.get_pull(PR_NUMBER).create_issue_comment(f"## 🔍 Review for `{file.filename}`\n\n{review_comments}")
-                logger.info(f"Posted review comments for {file.filename}")
-            except github.GithubException as e:
-                logger.error(f"Error posting comment for {file.filename}: {str(e)}")
+        # Execute review task for all files at once
+        file_reviews = review_task_func(file_contents, file_issues)
 
-            # Run linter to get issues for fix task
-            issues = run_linter(file_content, file.filename)
+        # Execute fix task; confirmations are asked here on the main thread, never from the pool
+        fixes = {}
+        for file_path, file_content in file_contents.items():
+            if file_path in fix_prs:
+                logger.info(f"Reusing fix PR #{fix_prs[file_path]} for {file_path}")
+                continue
+            issues = file_issues[file_path]
             if not issues:
-                logger.info(f"No fixable issues found in {file.filename}")
+                logger.info(f"No fixable issues found in {file_path}")
                 continue
-
-            # Execute fix task
-            fix_result = fix_task_func(file_content, issues, file.filename)
-            fixed_content = fix_result.get('fixed_content', file_content)
+            fix_result = fix_task_func(file_content, issues, file_path)
             fix_comments = fix_result.get('comments', [])
+            if fix_comments and confirm_fix_pr(file_path):
+                fixes[file_path] = (fix_result.get('fixed_content', file_content), fix_comments)
+
+        def run(file_path):
+            fixed_content, fix_comments = fixes[file_path]
+            try:
+                return create_fix_pr(pr, file_path, fixed_content, fix_comments)
+            except Exception as e:
+                logger.error(f"Error creating fix PR for {file_path}: {str(e)}")
+                return None
 
-            if fix_comments:
-                fix_pr_number = create_fix_pr(PR_NUMBER, file.filename, fixed_content, fix_comments)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for file_path, fix_pr_number in zip(fixes, executor.map(run, fixes)):
                 if fix_pr_number:
-                    try:
-                        repo.get_pull(PR_NUMBER).create_issue_comment(
-                            f"## 🔧 Automated Fixes\n\nCreated fix PR #{fix_pr_number} with automated fixes for `{file.filename}`."
-                        )
-                        logger.info(f"Posted fix PR link for {file.filename}")
-                    except github.GithubException as e:
-                        logger.error(f"Error posting fix PR comment for {file.filename}: {str(e)}")
+                    fix_prs[file_path] = fix_pr_number
+
+        # Record fix PRs before posting so a failed post never leads to recreating them
+        save_checkpoint(PR_NUMBER, head_sha, completed, fix_prs)
+
+        results = [
+            (file_path, build_review_section(file_path, file_reviews[file_path], fix_prs.get(file_path)))
+            for file_path in file_contents
+        ]
+
+        # Post all review sections in as few comments as GitHub's size limit allows
+        for body, finished in pack_comments(results):
+            try:
+                pr.create_issue_comment(body)
+                logger.info(f"Posted review comments for {len(finished)} file(s)")
+            except github.GithubException as e:
+                logger.error(f"Error posting review comment: {str(e)}")
+                return
+
+            completed.update(finished)
+            save_checkpoint(PR_NUMBER, head_sha, completed, fix_prs)
 
     except Exception as e:
         logger.error(f"Error in main process: {str(e)}")